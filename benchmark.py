@@ -0,0 +1,223 @@
+"""
+    Benchmark harness for every nbody variant in the repository.
+    - Discovers the nbody*.py and nbody*.pyx modules that define nbody()
+    - Runs each one in its own process, so the module-level BODIES of the
+      old variants start from the same initial conditions every time
+    - Records wall time, steps per second and peak resident memory, and
+      checks the final energy against the reference variant
+    - Writes the results as JSON so runs can be compared between releases
+
+    Usage:
+        python benchmark.py --loops 2 --iterations 1000 --n 5 \\
+            --output benchmark.json [variant ...]
+
+    The old variants only know the five-body solar system, they are
+    skipped for any other N. The reference is nbody.py for N = 5 and
+    nbody_array.py otherwise.
+    The legacy nbody_cython.pyx declares its variables as C float, so its
+    energy is single precision and is reported as a mismatch (relative
+    error about 2e-7) at the default tolerance.
+"""
+import argparse
+import contextlib
+import copy
+import glob
+import inspect
+import io
+import json
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import time
+from itertools import combinations
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def discover(directory=HERE):
+    '''
+        names of the modules in directory that define nbody(), .py before .pyx
+    '''
+    names = []
+    for pattern in ('nbody*.py', 'nbody*.pyx'):
+        for path in sorted(glob.glob(os.path.join(directory, pattern))):
+            name = os.path.splitext(os.path.basename(path))[0]
+            with open(path) as f:
+                # a cdef nbody() could not be called from Python
+                defines = re.search(r'^(cp)?def nbody\(', f.read(), re.M)
+            if defines and name not in names:
+                names.append(name)
+    return names
+
+
+def _import(name):
+    if not os.path.exists(os.path.join(HERE, name + '.py')):
+        import pyximport
+        pyximport.install(language_level=3)
+    return __import__(name)
+
+
+def _call(module, loops, iterations, n):
+    '''
+        run module.nbody with the arguments its signature asks for
+        returns the printed output, or None when the variant cannot run n
+    '''
+    params = inspect.signature(module.nbody).parameters
+    if 'system' in params:
+        import nbody_array
+        if n == 5:
+            system = nbody_array.solar_system()
+            reference = 'sun'
+        else:
+            from nbody_initial import random_cluster
+            system = random_cluster(n)
+            reference = system.names[0]
+        args = (loops, reference, iterations, system)
+    elif n != 5:
+        return None
+    elif 'BODIES' in params:
+        from nbody import BODIES
+        bodies = copy.deepcopy(BODIES)
+        args = (loops, 'sun', iterations, bodies)
+        if 'body_name_pairs' in params:
+            args += (list(combinations(bodies, 2)),)
+    else:
+        args = (loops, 'sun', iterations)
+
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        module.nbody(*args)
+    return out.getvalue()
+
+
+def run_one(name, loops, iterations, n):
+    '''
+        benchmark one variant in this process, returns a result dict
+    '''
+    result = {'variant': name, 'loops': loops, 'iterations': iterations,
+              'n': n}
+    try:
+        module = _import(name)
+    except Exception as ex:
+        result['status'] = 'import failed: {}: {}'.format(
+            type(ex).__name__, str(ex).strip().splitlines()[0])
+        return result
+    if not callable(getattr(module, 'nbody', None)):
+        result['status'] = 'no nbody() entry point'
+        return result
+
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    try:
+        output = _call(module, loops, iterations, n)
+    except Exception as ex:
+        result['status'] = 'run failed: {}: {}'.format(type(ex).__name__, ex)
+        return result
+    seconds = time.perf_counter() - start
+    if output is None:
+        result['status'] = 'skipped: only runs the 5-body system'
+        return result
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    energies = [float(line) for line in output.split()]
+    result.update({
+        'status': 'ok',
+        'seconds': seconds,
+        'steps_per_second': loops * iterations / seconds,
+        'peak_rss_kb': peak_rss,
+        'run_rss_kb': peak_rss - base_rss,
+        'final_energy': energies[-1] if energies else None,
+    })
+    return result
+
+
+def run_isolated(name, loops, iterations, n, timeout=None):
+    '''
+        benchmark one variant in a fresh interpreter
+    '''
+    command = [sys.executable, os.path.abspath(__file__), '--worker', name,
+               '--loops', str(loops), '--iterations', str(iterations),
+               '--n', str(n)]
+    try:
+        done = subprocess.run(command, cwd=HERE, stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE, timeout=timeout,
+                              universal_newlines=True)
+    except subprocess.TimeoutExpired:
+        return {'variant': name, 'loops': loops, 'iterations': iterations,
+                'n': n, 'status': 'timed out after {} sec'.format(timeout)}
+    if done.returncode != 0:
+        return {'variant': name, 'loops': loops, 'iterations': iterations,
+                'n': n, 'status': 'crashed: ' + done.stderr.strip()[-500:]}
+    return json.loads(done.stdout.strip().splitlines()[-1])
+
+
+def benchmark(variants, loops, iterations, n, rtol=1e-8, timeout=None):
+    '''
+        run every variant and check it against the reference energy
+        returns the report dict that is written as JSON
+    '''
+    reference = 'nbody' if n == 5 else 'nbody_array'
+    order = [reference] + [name for name in variants if name != reference]
+    results = [run_isolated(name, loops, iterations, n, timeout)
+               for name in order]
+
+    ref_energy = results[0].get('final_energy')
+    for result in results:
+        energy = result.get('final_energy')
+        if energy is None or ref_energy is None:
+            continue
+        result['energy_error'] = abs(energy - ref_energy) / abs(ref_energy)
+        result['energy_ok'] = result['energy_error'] <= rtol
+
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'reference': reference,
+        'reference_energy': ref_energy,
+        'rtol': rtol,
+        'results': [r for r in results if r['variant'] in variants],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('variants', nargs='*',
+                        help='variants to run, all discovered by default')
+    parser.add_argument('--loops', type=int, default=2)
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument('--n', type=int, default=5, help='number of bodies')
+    parser.add_argument('--rtol', type=float, default=1e-8,
+                        help='relative energy tolerance against reference')
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='seconds allowed per variant')
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        print(json.dumps(run_one(args.worker, args.loops, args.iterations,
+                                 args.n)))
+        return
+
+    variants = args.variants or discover()
+    report = benchmark(variants, args.loops, args.iterations, args.n,
+                       args.rtol, args.timeout)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for result in report['results']:
+        if result['status'] == 'ok':
+            print('{:>20} {:>9.3f} sec {:>12.0f} steps/sec  energy {}'.format(
+                result['variant'], result['seconds'],
+                result['steps_per_second'],
+                'ok' if result.get('energy_ok') else 'MISMATCH'))
+        else:
+            print('{:>20} {}'.format(result['variant'], result['status']))
+
+if __name__ == '__main__':
+    main()
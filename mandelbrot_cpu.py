@@ -0,0 +1,158 @@
+"""
+    CPU backends for the compute_mandel kernel of mandelbrot_gpu.py.
+    All of them take the same arguments as the CUDA kernel,
+        compute_mandel(min_x, max_x, min_y, max_y, image, iters)
+    and fill image in place, pixel (y, x) at
+        real = min_x + x * (max_x - min_x) / width
+        imag = min_y + y * (max_y - min_y) / height
+    with the escape-time loop of the mandel device function. The
+    arithmetic is the same, in the same order and without fastmath, so the
+    images are identical to the GPU ones, byte for byte; counts wrap
+    modulo 256 in a uint8 image as they do on the GPU.
+    With shortcuts (the default, as on the GPU) points inside the main
+    cardioid or the period-2 bulb are answered without iterating, and an
+    orbit that comes back exactly to a value it had before stops early
+    (Brent's cycle detection, the saved value is the z after iterations
+    1, 3, 7, 15, ..., 2^k - 1); both only ever skip points that would run
+    to max_iters.
+    - numba: @njit(parallel=True), a prange over the rows
+    - processes: a process pool over bands of rows, each band in plain
+      Python; the fallback when numba is not installed
+    - python: one process, plain Python, the reference
+    mandelbrot.py picks one automatically.
+"""
+import multiprocessing
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+ROWS = 16           # rows per band sent to a pool worker
+
+
+def escape(x, y, max_iters):
+    '''
+        escape-time count of x + iy, the plain loop
+    '''
+    c = complex(x, y)
+    z = 0.0j
+    for i in range(max_iters):
+        z = z*z + c
+        if (z.real*z.real + z.imag*z.imag) >= 4:
+            return i
+
+    return max_iters
+
+
+def mandel(x, y, max_iters):
+    '''
+        escape-time count of x + iy, as the mandel device function: the
+        plain loop with the interior test and cycle detection
+    '''
+    # main cardioid and period-2 bulb
+    q = (x - 0.25) * (x - 0.25) + y * y
+    if q * (q + (x - 0.25)) < 0.25 * y * y or \
+            (x + 1.0) * (x + 1.0) + y * y < 0.0625:
+        return max_iters
+
+    c = complex(x, y)
+    z = 0.0j
+    saved = 0.0j
+    steps = 0
+    power = 1
+    for i in range(max_iters):
+        z = z*z + c
+        if (z.real*z.real + z.imag*z.imag) >= 4:
+            return i
+        if z == saved:
+            return max_iters
+        steps += 1
+        if steps == power:
+            saved = z
+            power *= 2
+            steps = 0
+
+    return max_iters
+
+
+def _band(task):
+    '''
+        escape-time counts of the rows lo to hi, an int64 array
+    '''
+    (min_x, max_x, min_y, max_y, height, width, lo, hi, iters,
+     shortcuts) = task
+    count = mandel if shortcuts else escape
+    pixel_size_x = (max_x - min_x) / width
+    pixel_size_y = (max_y - min_y) / height
+    counts = np.empty((hi - lo, width), dtype=np.int64)
+    for y in range(lo, hi):
+        imag = min_y + y * pixel_size_y
+        counts[y - lo] = [count(min_x + x * pixel_size_x, imag, iters)
+                          for x in range(width)]
+    return counts
+
+
+def compute_mandel_python(min_x, max_x, min_y, max_y, image, iters,
+                          shortcuts=True):
+    (height, width) = image.shape
+    counts = _band((min_x, max_x, min_y, max_y, height, width, 0, height,
+                    iters, shortcuts))
+    # C casting wraps like the uint8 stores of the GPU kernel
+    image[...] = counts.astype(image.dtype)
+    return image
+
+
+def compute_mandel_processes(min_x, max_x, min_y, max_y, image, iters,
+                             shortcuts=True, workers=None, rows=ROWS):
+    '''
+        bands of rows rendered by a pool of workers processes
+    '''
+    (height, width) = image.shape
+    tasks = [(min_x, max_x, min_y, max_y, height, width, lo,
+              min(lo + rows, height), iters, shortcuts)
+             for lo in range(0, height, rows)]
+    # spawned, not forked: a fork of a process running numba or other
+    # threads can deadlock on a lock held by a thread that is not copied
+    with multiprocessing.get_context('spawn').Pool(workers) as pool:
+        for (task, counts) in zip(tasks, pool.imap(_band, tasks)):
+            image[task[6]:task[7]] = counts.astype(image.dtype)
+    return image
+
+
+if njit is not None:
+    escape_jit = njit(cache=True)(escape)
+    mandel_jit = njit(cache=True)(mandel)
+
+    @njit(parallel=True, cache=True)
+    def compute_rows_numba(min_x, max_x, min_y, max_y, height, lo, image,
+                           iters, shortcuts=True):
+        '''
+            rows lo to lo + len(image) of an image height rows tall, shared
+            out among the numba threads
+        '''
+        width = image.shape[1]
+
+        pixel_size_x = (max_x - min_x) / width
+        pixel_size_y = (max_y - min_y) / height
+
+        for row in prange(image.shape[0]):
+            imag = min_y + (lo + row) * pixel_size_y
+            for x in range(width):
+                real = min_x + x * pixel_size_x
+                if shortcuts:
+                    image[row, x] = mandel_jit(real, imag, iters)
+                else:
+                    image[row, x] = escape_jit(real, imag, iters)
+        return image
+
+    @njit(cache=True)
+    def compute_mandel_numba(min_x, max_x, min_y, max_y, image, iters,
+                             shortcuts=True):
+        '''
+            rows shared out among the numba threads
+        '''
+        return compute_rows_numba(min_x, max_x, min_y, max_y,
+                                  image.shape[0], 0, image, iters, shortcuts)
@@ -4,9 +4,11 @@
 # NetID: hl2514
 # Date: 04/27/2017
 #
+# Machines without a GPU: mandelbrot.py serves the same compute_mandel
+# API on the CPU and picks the backend automatically.
+#
 from numba import cuda
 import numpy as np
-from pylab import imshow, show
 
 @cuda.jit(device=True)
 def mandel(x, y, max_iters):
@@ -15,12 +17,31 @@ def mandel(x, y, max_iters):
     determine if it is a candidate for membership in the 
     Mandelbrot set given a fixed number of iterations.
     '''
+    # main cardioid and period-2 bulb never escape
+    q = (x - 0.25) * (x - 0.25) + y * y
+    if q * (q + (x - 0.25)) < 0.25 * y * y or \
+            (x + 1.0) * (x + 1.0) + y * y < 0.0625:
+        return max_iters
+
     c = complex(x, y)
     z = 0.0j
+    # Brent's cycle detection: an orbit back at an earlier value never
+    # escapes; the value compared against is the z after iterations 1, 3,
+    # 7, 15, ..., each kept twice as many iterations as the one before
+    saved = 0.0j
+    steps = 0
+    power = 1
     for i in range(max_iters):
         z = z*z + c
         if (z.real*z.real + z.imag*z.imag) >= 4:
             return i
+        if z == saved:
+            return max_iters
+        steps += 1
+        if steps == power:
+            saved = z
+            power *= 2
+            steps = 0
 
     return max_iters
 
@@ -37,18 +58,31 @@ def compute_mandel(min_x, max_x, min_y, max_y, image, iters):
     pixel_size_y = (max_y - min_y) / height
     
     y, x = cuda.grid(2)
-    
+    # the grid is rounded up to whole blocks
+    if y >= height or x >= width:
+        return
+
     real = min_x + x * pixel_size_x
     imag = min_y + y * pixel_size_y
     image[y, x] = mandel(real, imag, iters)
+
+def render(min_x, max_x, min_y, max_y, image, iters, blockdim=(32, 32)):
+    '''
+    Run compute_mandel over the whole host image and copy the result
+    back into it
+    '''
+    griddim = ((image.shape[0] + blockdim[0] - 1) // blockdim[0],
+               (image.shape[1] + blockdim[1] - 1) // blockdim[1])
+    image_global_mem = cuda.to_device(image)
+    compute_mandel[griddim, blockdim](min_x, max_x, min_y, max_y,
+                                      image_global_mem, iters)
+    image_global_mem.copy_to_host(image)
+    return image
     
 if __name__ == '__main__':
+    from pylab import imshow, show
+
     image = np.zeros((1024, 1536), dtype = np.uint8)
-    blockdim = (32, 32)
-    griddim = (32, 48)
-    
-    image_global_mem = cuda.to_device(image)
-    compute_mandel[griddim, blockdim](-2.0, 1.0, -1.0, 1.0, image_global_mem, 20) 
-    image_global_mem.copy_to_host()
+    render(-2.0, 1.0, -1.0, 1.0, image, 20)
     imshow(image)
     show()
\ No newline at end of file
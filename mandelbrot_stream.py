@@ -0,0 +1,137 @@
+"""
+    Headless rendering of images too large for memory, straight to disk.
+    The image file is laid out first: a binary PGM (P5, maxval 255) or a
+    .npy file of uint8, both of which other tools can memory-map. Its
+    pixels are then rendered in bands of rows by a pool of worker
+    processes. Each worker writes its bands at their offset in the file,
+    so no image passes through the parent and no process holds more than
+    one band. Memory stays at workers x band, whatever the image size;
+    writing through a memory map instead would count every page a worker
+    wrote in its resident memory.
+    Pixels have the coordinates of compute_mandel in mandelbrot_gpu.py
+    for the whole image, and counts wrap modulo 256 as in its uint8
+    images. A band is the same bytes as the matching rows of a single
+    compute_mandel call.
+    Bands are rendered by mandelbrot_cpu.compute_rows_numba when numba is
+    installed, and by a mandelbrot_numpy.EscapeState otherwise.
+
+    python mandelbrot_stream.py mandel.pgm --shape 32768 49152 renders
+    1.6 gigapixels of the view of mandelbrot_gpu.py, a 1.6 GB file. One
+    core, iters = 20, 2 workers, BAND pixels a band:
+        32 sec, 5.0e7 pixels per second
+        peak resident memory 96 MB in the parent, 143 MB in a worker, the
+        same as for a 0.1 gigapixel image
+"""
+import argparse
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+import mandelbrot_cpu
+
+BAND = 2 ** 20      # pixels in a band
+
+_image = None       # (file descriptor, offset, shape) in each worker
+
+
+def create(path, shape):
+    '''
+        lay out an image file of shape (height, width) for the renderer,
+        a binary PGM or a .npy file by the suffix of path
+        returns the offset of the pixels in the file
+    '''
+    (height, width) = shape
+    if path.endswith('.npy'):
+        image = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8,
+                                          shape=shape)
+        offset = image.offset
+        del image
+        return offset
+    if not path.endswith('.pgm'):
+        raise ValueError('expected a .pgm or .npy file, got {!r}'.format(
+            path))
+    header = 'P5\n{} {}\n255\n'.format(width, height).encode('ascii')
+    with open(path, 'wb') as f:
+        f.write(header)
+        # a sparse file, the pixels are written by the workers
+        f.truncate(len(header) + height * width)
+    return len(header)
+
+
+def _open(path, offset, shape):
+    global _image
+    _image = (os.open(path, os.O_WRONLY), offset, shape)
+
+
+def _render_band(task):
+    '''
+        render the rows lo to hi of the image file, returns hi - lo
+    '''
+    (min_x, max_x, min_y, max_y, lo, hi, iters) = task
+    (fd, offset, (height, width)) = _image
+    band = np.empty((hi - lo, width), dtype=np.uint8)
+    if mandelbrot_cpu.njit is not None:
+        mandelbrot_cpu.compute_rows_numba(min_x, max_x, min_y, max_y,
+                                          height, lo, band, iters)
+    else:
+        from mandelbrot_numpy import EscapeState
+        pixel_size_x = (max_x - min_x) / width
+        pixel_size_y = (max_y - min_y) / height
+        state = EscapeState.from_axes(
+            min_x + np.arange(width) * pixel_size_x,
+            min_y + np.arange(lo, hi) * pixel_size_y)
+        # C casting wraps like the uint8 stores of the GPU kernel
+        band[...] = state.iterate(iters).counts(iters).astype(np.uint8)
+    os.pwrite(fd, band, offset + lo * width)
+    return hi - lo
+
+
+def render(path, min_x, max_x, min_y, max_y, shape, iters, workers=None,
+           band=BAND):
+    '''
+        render the region into a new image file at path, with workers
+        processes (all cores by default, 1 renders in this process) and
+        bands of about band pixels
+        returns pixels per second
+    '''
+    (height, width) = shape
+    start = time.perf_counter()
+    offset = create(path, shape)
+    rows = max(1, band // width)
+    tasks = [(min_x, max_x, min_y, max_y, lo, min(lo + rows, height), iters)
+             for lo in range(0, height, rows)]
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        _open(path, offset, shape)
+        for task in tasks:
+            _render_band(task)
+        os.close(_image[0])
+    else:
+        # spawned, not forked, as in mandelbrot_cpu.compute_mandel_processes
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(workers, _open, (path, offset, shape)) as pool:
+            for _ in pool.imap_unordered(_render_band, tasks):
+                pass
+    return height * width / (time.perf_counter() - start)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='render a Mandelbrot image to a .pgm or .npy file')
+    parser.add_argument('path')
+    parser.add_argument('--shape', type=int, nargs=2,
+                        default=(1024, 1536), metavar=('HEIGHT', 'WIDTH'))
+    parser.add_argument('--view', type=float, nargs=4,
+                        default=(-2.0, 1.0, -1.0, 1.0),
+                        metavar=('MIN_X', 'MAX_X', 'MIN_Y', 'MAX_Y'))
+    parser.add_argument('--iters', type=int, default=20)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--band', type=int, default=BAND,
+                        help='pixels in a band of rows')
+    args = parser.parse_args()
+
+    rate = render(args.path, *args.view, shape=tuple(args.shape),
+                  iters=args.iters, workers=args.workers, band=args.band)
+    print('{}: {} x {} pixels, {:.3g} pixels per second'.format(
+        args.path, args.shape[0], args.shape[1], rate))
@@ -0,0 +1,386 @@
+"""
+    N-body simulation on an array-backed system.
+    - Positions and velocities are contiguous N x 3 float64 arrays, or
+      float32 in mixed precision mode
+    - Masses are a float64 N-vector
+    - Body names map to row indices, so the public API still takes names
+    - advance/report_energy/offset_momentum work on vectorized pairwise deltas
+      instead of unpacking BODIES tuples for every pair
+"""
+import inspect
+
+import numpy as np
+
+from nbody_pairs import BLOCK, schedule
+
+
+class NBodySystem(object):
+    '''
+        structure-of-arrays state of an N-body system
+        positions  - N x 3 array
+        velocities - N x 3 array
+        masses     - length N float64 array
+        names      - optional list of body names, one per row, the
+                     row numbers as strings by default
+        dtype      - storage type of positions and velocities, float64 or
+                     float32 for mixed precision: the state is stored in
+                     float32, forces and energies are still computed and
+                     accumulated in float64
+    '''
+
+    def __init__(self, positions, velocities, masses, names=None,
+                 dtype=np.float64):
+        dtype = np.dtype(dtype)
+        if dtype not in (np.float64, np.float32):
+            raise ValueError('dtype must be float64 or float32, not '
+                             '{}'.format(dtype))
+        self.positions = np.ascontiguousarray(positions, dtype=dtype)
+        self.velocities = np.ascontiguousarray(velocities, dtype=dtype)
+        self.masses = np.ascontiguousarray(masses, dtype=np.float64)
+
+        n = self.masses.shape[0]
+        if self.positions.shape != (n, 3) or self.velocities.shape != (n, 3):
+            raise ValueError('positions and velocities must have shape '
+                             '({}, 3)'.format(n))
+        if names is not None and len(names) != n:
+            raise ValueError('expected {} names, got {}'.format(n, len(names)))
+        # built on first use, so large systems without names stay cheap
+        self._names = None if names is None else list(names)
+        self._index = None
+
+    @property
+    def names(self):
+        if self._names is None:
+            self._names = [str(i) for i in range(len(self))]
+        return self._names
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = dict((name, i) for (i, name) in enumerate(self.names))
+        return self._index
+
+    def __len__(self):
+        return self.masses.shape[0]
+
+    def __getitem__(self, name):
+        '''
+            (position, velocity, mass) of a body, the arrays are views
+        '''
+        i = self.index[name]
+        return (self.positions[i], self.velocities[i], self.masses[i])
+
+    @classmethod
+    def from_bodies(cls, bodies):
+        '''
+            build a system from a BODIES style dict
+            {name: ([x, y, z], [vx, vy, vz], m)}
+        '''
+        names = list(bodies)
+        positions = [bodies[name][0] for name in names]
+        velocities = [bodies[name][1] for name in names]
+        masses = [bodies[name][2] for name in names]
+        return cls(positions, velocities, masses, names)
+
+    @property
+    def dtype(self):
+        return self.positions.dtype
+
+    def copy(self):
+        return NBodySystem(self.positions.copy(), self.velocities.copy(),
+                           self.masses.copy(), self._names, self.dtype)
+
+    def astype(self, dtype):
+        '''
+            copy of the system with positions and velocities stored as dtype
+        '''
+        return NBodySystem(self.positions.astype(dtype),
+                           self.velocities.astype(dtype), self.masses.copy(),
+                           self._names, dtype)
+
+
+def solar_system():
+    '''
+        the sun and the four gas giants, as in nbody.py
+    '''
+    from nbody_initial import solar_system
+    return solar_system()
+
+
+def direct_accelerations(positions, masses, targets=None, pairs=None,
+                         potential=False, softening=0.0):
+    '''
+        exact pairwise gravitational accelerations, an N x 3 array
+        targets - optional indices of the bodies to compute the
+                  acceleration of, the result then has len(targets) rows
+        pairs - optional (i, j) index arrays, the nbody_pairs schedule of
+                N bodies by default
+        potential - also return the potential energy, computed from the
+                    same pair distances: (accelerations, potential)
+        softening - Plummer softening length eps, 1 / r^2 becomes
+                    1 / (r^2 + eps^2) so close encounters stay finite
+    '''
+    n = masses.shape[0]
+    if targets is not None:
+        return _target_accelerations(positions, masses, targets, softening)
+    blocks = schedule(n).blocks() if pairs is None else [pairs]
+
+    # float64 accumulators, whatever the storage type of positions
+    acc = np.zeros(positions.shape)
+    e = 0.0
+    for (i, j) in blocks:
+        d = np.subtract(positions[i], positions[j], dtype=np.float64)
+        r2 = (d * d).sum(axis=1)
+        if softening:
+            r2 += softening * softening
+        mag = r2 ** (-1.5)
+        for k in range(3):
+            f = d[:, k] * mag
+            acc[:, k] += (np.bincount(j, f * masses[i], minlength=n) -
+                          np.bincount(i, f * masses[j], minlength=n))
+        if potential:
+            # 1 / r = r^2 / r^3
+            e -= (masses[i] * masses[j] * r2 * mag).sum()
+    if potential:
+        return (acc, e)
+    return acc
+
+
+def _target_accelerations(positions, masses, targets, softening=0.0):
+    '''
+        acceleration of a subset of bodies from every other body, in
+        chunks of targets of at most BLOCK pairs, so the separations take
+        24 * BLOCK bytes however many targets there are
+    '''
+    targets = np.asarray(targets)
+    acc = np.empty((len(targets), 3))
+    rows = max(1, BLOCK // max(len(masses), 1))
+    for lo in range(0, len(targets), rows):
+        chunk = targets[lo:lo + rows]
+        d = np.subtract(positions[chunk][:, None, :], positions[None, :, :],
+                        dtype=np.float64)
+        r2 = (d * d).sum(axis=2)
+        if softening:
+            r2 += softening * softening
+        r2[np.arange(len(chunk)), chunk] = np.inf
+        acc[lo:lo + rows] = -np.einsum('tjk,tj->tk', d,
+                                       masses * r2 ** (-1.5))
+    return acc
+
+
+def advance(dt, system, kernel=direct_accelerations):
+    '''
+        advance the system one timestep
+    '''
+    system.velocities += dt * kernel(system.positions, system.masses)
+    system.positions += dt * system.velocities
+
+
+def advance_with_potential(dt, system, kernel=direct_accelerations):
+    '''
+        advance the system one timestep and return the potential energy
+        of the positions the step started from, a by-product of the force
+        sweep; kernel must accept potential=True
+    '''
+    (acc, potential) = kernel(system.positions, system.masses,
+                              potential=True)
+    system.velocities += dt * acc
+    system.positions += dt * system.velocities
+    return potential
+
+
+def potential_energy(positions, masses, pairs=None, softening=0.0):
+    '''
+        pairwise gravitational potential energy
+        softening - Plummer softening length, as in direct_accelerations
+    '''
+    blocks = schedule(len(masses)).blocks() if pairs is None else [pairs]
+    e = 0.0
+    for (i, j) in blocks:
+        d = np.subtract(positions[i], positions[j], dtype=np.float64)
+        r2 = (d * d).sum(axis=1) + softening * softening
+        e -= (masses[i] * masses[j] / np.sqrt(r2)).sum()
+    return e
+
+
+def kinetic_energy(velocities, masses):
+    velocities = np.asarray(velocities, dtype=np.float64)
+    return 0.5 * (masses * (velocities * velocities).sum(axis=1)).sum()
+
+
+def momentum(velocities, masses):
+    '''
+        total linear momentum, a 3-vector
+    '''
+    return (masses[:, None] * velocities).sum(axis=0)
+
+
+def angular_momentum(positions, velocities, masses):
+    '''
+        total angular momentum about the origin, a 3-vector
+    '''
+    positions = np.asarray(positions, dtype=np.float64)
+    return (masses[:, None] * np.cross(positions, velocities)).sum(axis=0)
+
+
+def report_energy(system, e=0.0, softening=0.0):
+    '''
+        compute the energy and return it so that it can be printed
+        softening - Plummer softening length of the kernel in use
+    '''
+    e += potential_energy(system.positions, system.masses,
+                          softening=softening)
+    e += kinetic_energy(system.velocities, system.masses)
+    return e
+
+
+def _accepts_potential(kernel):
+    '''
+        False if kernel surely does not take potential=True
+    '''
+    try:
+        parameters = inspect.signature(kernel).parameters.values()
+    except (TypeError, ValueError):
+        # no signature to go by, let the first call tell
+        return True
+    return any(p.name == 'potential' or p.kind == p.VAR_KEYWORD
+               for p in parameters)
+
+
+def offset_momentum(ref, system):
+    '''
+        ref is the name of the body in the center of the system
+        offset its velocity so that the total momentum is zero
+    '''
+    i = system.index[ref]
+    p = -(system.masses[:, None] * system.velocities).sum(axis=0)
+    system.velocities[i] = p / system.masses[i]
+
+
+def nbody(loops, reference, iterations, system=None,
+          kernel=direct_accelerations, integrator=advance, dt=0.01,
+          workers=None, trajectory=None, checkpoint=None,
+          checkpoint_every=1000, resume=None, fused=False, profile=False,
+          energy=report_energy, diagnostics=None):
+    '''
+        nbody simulation
+        loops - number of loops to run
+        reference - body at center of system
+        iterations - number of timesteps to advance
+        system - NBodySystem to evolve, the solar system by default
+        kernel - function (positions, masses[, targets]) -> accelerations
+        integrator - function (dt, system, kernel) advancing one timestep,
+                     advance or an instance of one of the nbody_integrators
+                     classes, e.g. Leapfrog()
+        dt - timestep
+        workers - evaluate forces in this many processes sharing the body
+                  state through shared memory, see nbody_parallel
+        trajectory - optional nbody_io.TrajectoryWriter, given the state
+                     after every step (it keeps one every k steps)
+        checkpoint - path to write a checkpoint to every checkpoint_every
+                     steps, see nbody_io.save_checkpoint
+        resume - checkpoint path to continue from, the run then follows
+                 exactly the trajectory of the uninterrupted run
+        fused - take the potential energy of each report from the force
+                sweep of the next step instead of a separate pair sweep,
+                the report is printed one step later; needs the default
+                integrator, a kernel that accepts potential=True and no
+                workers
+        profile - True to time the force, step, energy and io phases and
+                  print a summary to stderr at the end, or an
+                  nbody_profile.Profiler to collect into
+        energy - function (system) -> total energy for the reports, it
+                 should match the force model of kernel, e.g.
+                 partial(report_energy, softening=eps)
+        diagnostics - optional nbody_diagnostics.AsyncDiagnostics, given a
+                      snapshot at every report instead of printing the
+                      energy; the reports are computed in the background
+                      and are all written when nbody returns
+    '''
+    if fused and integrator is not advance:
+        raise ValueError('fused energy reporting needs integrator=advance')
+    if fused and diagnostics is not None:
+        raise ValueError('fused energy reporting and diagnostics exclude '
+                         'each other')
+    if fused and workers is not None and workers > 1:
+        raise ValueError('fused energy reporting needs workers=None, the '
+                         'shared-memory kernel does not return the '
+                         'potential')
+    if fused and not _accepts_potential(kernel):
+        raise ValueError('fused energy reporting needs a kernel that '
+                         'accepts potential=True')
+    step = 0
+    if resume is not None:
+        from nbody_io import load_checkpoint
+        (system, step) = load_checkpoint(resume, integrator)
+    else:
+        if system is None:
+            system = solar_system()
+        offset_momentum(reference, system)
+    save = None
+    if checkpoint is not None:
+        from nbody_io import save_checkpoint as save
+
+    pool = None
+    if workers is not None and workers > 1:
+        from nbody_parallel import SharedMemoryKernel
+        pool = kernel = SharedMemoryKernel(system, workers, kernel)
+
+    stepper = advance_with_potential if fused else integrator
+    emit = print
+    record = trajectory.record if trajectory is not None else None
+    submit = diagnostics.submit if diagnostics is not None else None
+    profiler = None
+    if profile:
+        from nbody_profile import Profiler
+        profiler = profile if isinstance(profile, Profiler) else Profiler()
+        kernel = profiler.wrap_kernel(kernel, len(system))
+        stepper = profiler.wrap('step', stepper)
+        energy = profiler.wrap('energy', energy)
+        emit = profiler.wrap('io', emit)
+        if record is not None:
+            record = profiler.wrap('io', record)
+        if save is not None:
+            save = profiler.wrap('io', save)
+        if submit is not None:
+            submit = profiler.wrap('energy', submit)
+
+    if record is not None and step == 0:
+        record(step, system)
+    # kinetic energy of a report still waiting for its potential energy
+    kinetic = None
+    try:
+        while step < loops * iterations:
+            potential = stepper(dt, system, kernel)
+            if kinetic is not None:
+                emit(potential + kinetic)
+                kinetic = None
+            step += 1
+            if record is not None:
+                record(step, system)
+            if step % iterations == 0:
+                if submit is not None:
+                    submit(step, system)
+                elif fused:
+                    kinetic = kinetic_energy(system.velocities, system.masses)
+                else:
+                    emit(energy(system))
+            if save is not None and step % checkpoint_every == 0:
+                if kinetic is not None:
+                    emit(energy(system))
+                    kinetic = None
+                save(checkpoint, system, step, integrator)
+        if kinetic is not None:
+            emit(energy(system))
+        if diagnostics is not None:
+            diagnostics.wait()
+    finally:
+        if pool is not None:
+            pool.close()
+
+    if profile is True:
+        profiler.print_report()
+    return system
+
+if __name__ == '__main__':
+    nbody(100, 'sun', 20000)
@@ -94,7 +94,8 @@ cdef offset_momentum(tuple ref, dict BODIES, float px=0.0, float py=0.0, float p
     v[2] = pz / m
 
 
-cdef nbody(int loops, str reference, int iterations, dict BODIES, list body_name_pairs):
+# cpdef, not cdef, so that benchmark.py can call it from Python
+cpdef nbody(int loops, str reference, int iterations, dict BODIES, list body_name_pairs):
     '''
         nbody simulation
         loops - number of loops to run
@@ -0,0 +1,220 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""
+    N-body simulation, Cython on double precision typed memoryviews.
+    - State lives in an nbody_array.NBodySystem, the kernels see it as
+      double[:, ::1] / double[::1] memoryviews, no Python objects per pair
+    - boundscheck and wraparound are off
+    - The whole inner loop of iterations runs with the GIL released
+    - Operations are done in the same order as nbody.py and use pow() like
+      Python's ** does, so the energies match nbody.py bit for bit
+    - advance(..., schedule=nbody_pairs.schedule(n)) runs over the int32
+      pair arrays of the shared schedule instead of the nested loop
+
+    Build in place with:
+        cythonize -i nbody_cython_typed.pyx
+"""
+from libc.math cimport pow
+
+import nbody_array
+
+
+cdef void _advance(double dt, double[:, ::1] r, double[:, ::1] v,
+                   double[::1] m, long steps) nogil:
+    '''
+        advance the system steps timesteps
+    '''
+    cdef Py_ssize_t n = m.shape[0]
+    cdef Py_ssize_t i, j
+    cdef long step
+    cdef double dx, dy, dz, mag, mag_1, mag_2
+
+    for step in range(steps):
+        for i in range(n):
+            for j in range(i + 1, n):
+                dx = r[i, 0] - r[j, 0]
+                dy = r[i, 1] - r[j, 1]
+                dz = r[i, 2] - r[j, 2]
+
+                mag = dt * pow(dx * dx + dy * dy + dz * dz, -1.5)
+                mag_2 = m[j] * mag
+                mag_1 = m[i] * mag
+
+                v[i, 0] -= dx * mag_2
+                v[i, 1] -= dy * mag_2
+                v[i, 2] -= dz * mag_2
+                v[j, 0] += dx * mag_1
+                v[j, 1] += dy * mag_1
+                v[j, 2] += dz * mag_1
+
+        for i in range(n):
+            r[i, 0] += dt * v[i, 0]
+            r[i, 1] += dt * v[i, 1]
+            r[i, 2] += dt * v[i, 2]
+
+
+cdef double _energy(double[:, ::1] r, double[:, ::1] v, double[::1] m,
+                    double e) nogil:
+    cdef Py_ssize_t n = m.shape[0]
+    cdef Py_ssize_t i, j
+    cdef double dx, dy, dz
+
+    for i in range(n):
+        for j in range(i + 1, n):
+            dx = r[i, 0] - r[j, 0]
+            dy = r[i, 1] - r[j, 1]
+            dz = r[i, 2] - r[j, 2]
+            e -= (m[i] * m[j]) / pow(dx * dx + dy * dy + dz * dz, 0.5)
+    return _kinetic(v, m, e)
+
+
+cdef double _kinetic(double[:, ::1] v, double[::1] m, double e) nogil:
+    cdef Py_ssize_t i
+
+    for i in range(m.shape[0]):
+        e += m[i] * (v[i, 0] * v[i, 0] + v[i, 1] * v[i, 1] +
+                     v[i, 2] * v[i, 2]) / 2.
+    return e
+
+
+cdef void _kick(double dt, double[:, ::1] r, double[:, ::1] v,
+                double[::1] m, const int[::1] pi, const int[::1] pj) nogil:
+    '''
+        velocity update from the pairs (pi[k], pj[k])
+    '''
+    cdef Py_ssize_t k, i, j
+    cdef double dx, dy, dz, mag, mag_1, mag_2
+
+    for k in range(pi.shape[0]):
+        i = pi[k]
+        j = pj[k]
+        dx = r[i, 0] - r[j, 0]
+        dy = r[i, 1] - r[j, 1]
+        dz = r[i, 2] - r[j, 2]
+
+        mag = dt * pow(dx * dx + dy * dy + dz * dz, -1.5)
+        mag_2 = m[j] * mag
+        mag_1 = m[i] * mag
+
+        v[i, 0] -= dx * mag_2
+        v[i, 1] -= dy * mag_2
+        v[i, 2] -= dz * mag_2
+        v[j, 0] += dx * mag_1
+        v[j, 1] += dy * mag_1
+        v[j, 2] += dz * mag_1
+
+
+cdef void _drift(double dt, double[:, ::1] r, double[:, ::1] v) nogil:
+    cdef Py_ssize_t i
+
+    for i in range(r.shape[0]):
+        r[i, 0] += dt * v[i, 0]
+        r[i, 1] += dt * v[i, 1]
+        r[i, 2] += dt * v[i, 2]
+
+
+cdef double _potential(double[:, ::1] r, double[::1] m, const int[::1] pi,
+                       const int[::1] pj, double e) nogil:
+    cdef Py_ssize_t k, i, j
+    cdef double dx, dy, dz
+
+    for k in range(pi.shape[0]):
+        i = pi[k]
+        j = pj[k]
+        dx = r[i, 0] - r[j, 0]
+        dy = r[i, 1] - r[j, 1]
+        dz = r[i, 2] - r[j, 2]
+        e -= (m[i] * m[j]) / pow(dx * dx + dy * dy + dz * dz, 0.5)
+    return e
+
+
+def advance(double dt, system, long steps=1, schedule=None):
+    '''
+        advance the system steps timesteps
+        schedule - optional nbody_pairs.PairSchedule to run over
+    '''
+    cdef double[:, ::1] r = system.positions
+    cdef double[:, ::1] v = system.velocities
+    cdef double[::1] m = system.masses
+    cdef const int[::1] pi
+    cdef const int[::1] pj
+    cdef long step
+
+    if schedule is None:
+        with nogil:
+            _advance(dt, r, v, m, steps)
+    elif schedule.stored:
+        pi = schedule.i
+        pj = schedule.j
+        with nogil:
+            for step in range(steps):
+                _kick(dt, r, v, m, pi, pj)
+                _drift(dt, r, v)
+    else:
+        for step in range(steps):
+            for (pi, pj) in schedule.blocks():
+                with nogil:
+                    _kick(dt, r, v, m, pi, pj)
+            with nogil:
+                _drift(dt, r, v)
+
+
+def report_energy(system, double e=0.0, schedule=None):
+    '''
+        compute the energy and return it so that it can be printed
+    '''
+    cdef double[:, ::1] r = system.positions
+    cdef double[:, ::1] v = system.velocities
+    cdef double[::1] m = system.masses
+    cdef const int[::1] pi
+    cdef const int[::1] pj
+
+    if schedule is None:
+        with nogil:
+            e = _energy(r, v, m, e)
+        return e
+    for (pi, pj) in schedule.blocks():
+        with nogil:
+            e = _potential(r, m, pi, pj, e)
+    with nogil:
+        e = _kinetic(v, m, e)
+    return e
+
+
+def offset_momentum(ref, system):
+    '''
+        ref is the name of the body in the center of the system
+        offset values from this reference
+    '''
+    cdef double[:, ::1] v = system.velocities
+    cdef double[::1] m = system.masses
+    cdef double px = 0.0, py = 0.0, pz = 0.0
+    cdef Py_ssize_t i, k = system.index[ref]
+
+    for i in range(m.shape[0]):
+        px -= v[i, 0] * m[i]
+        py -= v[i, 1] * m[i]
+        pz -= v[i, 2] * m[i]
+
+    v[k, 0] = px / m[k]
+    v[k, 1] = py / m[k]
+    v[k, 2] = pz / m[k]
+
+
+def nbody(int loops, str reference, long iterations, system=None):
+    '''
+        nbody simulation
+        loops - number of loops to run
+        reference - body at center of system
+        iterations - number of timesteps to advance
+        system - NBodySystem to evolve, the solar system by default
+    '''
+    if system is None:
+        system = nbody_array.solar_system()
+    offset_momentum(reference, system)
+
+    cdef int i
+    for i in range(loops):
+        advance(0.01, system, iterations)
+        print(report_energy(system))
+
+    return system
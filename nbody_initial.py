@@ -0,0 +1,245 @@
+"""
+    Initial conditions for the array-backed N-body engine.
+    Every function returns an nbody_array.NBodySystem built straight from
+    arrays, no BODIES dict in between.
+
+    Files
+    - CSV: header name,x,y,z,vx,vy,vz,m (the name column is optional)
+    - .npy: one N x 7 float64 array of x, y, z, vx, vy, vz, m rows
+    - binary (.nbody): a 64-byte header (magic 'NBBODY01', bodies, length
+      of the names block) followed by contiguous positions (N x 3),
+      velocities (N x 3) and masses (N) blocks and an optional JSON list
+      of names. load_binary memory-maps the blocks, so loading a
+      10^6-body file reads nothing until the data is used.
+    Generators
+    - plummer, uniform_disk, random_cluster
+"""
+import json
+
+import numpy as np
+
+from nbody_array import NBodySystem
+
+PI = 3.14159265358979323
+SOLAR_MASS = 4 * PI * PI
+DAYS_PER_YEAR = 365.24
+
+SOLAR_NAMES = ['sun', 'jupiter', 'saturn', 'uranus', 'neptune']
+
+SOLAR_POSITIONS = np.array([
+    [0.0, 0.0, 0.0],
+    [4.84143144246472090e+00, -1.16032004402742839e+00,
+     -1.03622044471123109e-01],
+    [8.34336671824457987e+00, 4.12479856412430479e+00,
+     -4.03523417114321381e-01],
+    [1.28943695621391310e+01, -1.51111514016986312e+01,
+     -2.23307578892655734e-01],
+    [1.53796971148509165e+01, -2.59193146099879641e+01,
+     1.79258772950371181e-01]])
+
+# per day, multiplied by DAYS_PER_YEAR below
+SOLAR_VELOCITIES = np.array([
+    [0.0, 0.0, 0.0],
+    [1.66007664274403694e-03, 7.69901118419740425e-03,
+     -6.90460016972063023e-05],
+    [-2.76742510726862411e-03, 4.99852801234917238e-03,
+     2.30417297573763929e-05],
+    [2.96460137564761618e-03, 2.37847173959480950e-03,
+     -2.96589568540237556e-05],
+    [2.68067772490389322e-03, 1.62824170038242295e-03,
+     -9.51592254519715870e-05]]) * DAYS_PER_YEAR
+
+# in solar masses, multiplied by SOLAR_MASS below
+SOLAR_MASSES = np.array([
+    1.0,
+    9.54791938424326609e-04,
+    2.85885980666130812e-04,
+    4.36624404335156298e-05,
+    5.15138902046611451e-05]) * SOLAR_MASS
+
+BINARY_MAGIC = b'NBBODY01'
+
+BINARY_HEADER = np.dtype([
+    ('magic', 'S8'),
+    ('bodies', '<u8'),
+    ('names', '<u8'),
+    ('reserved', 'V40'),
+])
+
+
+def solar_system():
+    '''
+        the sun and the four gas giants, the initial conditions of nbody.py
+    '''
+    return NBodySystem(SOLAR_POSITIONS.copy(), SOLAR_VELOCITIES.copy(),
+                       SOLAR_MASSES.copy(), SOLAR_NAMES)
+
+
+def load_csv(path):
+    '''
+        read a name,x,y,z,vx,vy,vz,m CSV file, the name column is optional
+    '''
+    table = np.genfromtxt(path, delimiter=',', names=True, dtype=None,
+                          encoding='utf-8', ndmin=1)
+    columns = table.dtype.names
+    positions = np.column_stack([table['x'], table['y'], table['z']])
+    velocities = np.column_stack([table['vx'], table['vy'], table['vz']])
+    names = [str(name) for name in table['name']] \
+        if 'name' in columns else None
+    return NBodySystem(positions, velocities, table['m'], names)
+
+
+def save_csv(path, system):
+    with open(path, 'w') as f:
+        f.write('name,x,y,z,vx,vy,vz,m\n')
+        for (i, name) in enumerate(system.names):
+            (x, y, z) = system.positions[i]
+            (vx, vy, vz) = system.velocities[i]
+            f.write('{},{!r},{!r},{!r},{!r},{!r},{!r},{!r}\n'.format(
+                name, float(x), float(y), float(z), float(vx), float(vy),
+                float(vz), float(system.masses[i])))
+
+
+def load_npy(path):
+    '''
+        read an N x 7 .npy array of x, y, z, vx, vy, vz, m rows
+        the file is memory-mapped and its columns copied once into the
+        contiguous arrays of the system
+    '''
+    table = np.load(path, mmap_mode='r')
+    if table.ndim != 2 or table.shape[1] != 7:
+        raise ValueError('{} must hold an N x 7 array, not {}'.format(
+            path, table.shape))
+    return NBodySystem(table[:, 0:3], table[:, 3:6], table[:, 6])
+
+
+def save_npy(path, system):
+    np.save(path, np.column_stack([system.positions, system.velocities,
+                                   system.masses]))
+
+
+def _binary_layout(bodies):
+    '''
+        byte offsets of the positions, velocities, masses and names blocks
+    '''
+    positions = BINARY_HEADER.itemsize
+    velocities = positions + 24 * bodies
+    masses = velocities + 24 * bodies
+    return (positions, velocities, masses, masses + 8 * bodies)
+
+
+def load_binary(path, mode='c'):
+    '''
+        memory-map a binary body file, nothing is copied
+        mode - 'c' (default) copy-on-write, the file never changes;
+               'r+' evolves the system inside the file; 'r' read-only
+    '''
+    header = np.fromfile(path, dtype=BINARY_HEADER, count=1)[0]
+    if header['magic'] != BINARY_MAGIC:
+        raise ValueError('{} is not a binary body file'.format(path))
+    n = int(header['bodies'])
+    (pos, vel, mass, names) = _binary_layout(n)
+    positions = np.memmap(path, dtype='<f8', mode=mode, offset=pos,
+                          shape=(n, 3))
+    velocities = np.memmap(path, dtype='<f8', mode=mode, offset=vel,
+                           shape=(n, 3))
+    masses = np.memmap(path, dtype='<f8', mode=mode, offset=mass,
+                       shape=(n,))
+    body_names = None
+    if header['names']:
+        with open(path, 'rb') as f:
+            f.seek(names)
+            body_names = json.loads(f.read(int(header['names'])).decode())
+    return NBodySystem(positions, velocities, masses, body_names)
+
+
+def save_binary(path, system, names=True):
+    '''
+        write a binary body file, names=False leaves the names out; a
+        system without names is written without them either way
+    '''
+    block = b''
+    if names and system._names is not None:
+        block = json.dumps(system._names).encode()
+    header = np.zeros(1, dtype=BINARY_HEADER)
+    header['magic'] = BINARY_MAGIC
+    header['bodies'] = len(system)
+    header['names'] = len(block)
+    with open(path, 'wb') as f:
+        f.write(header.tobytes())
+        for a in (system.positions, system.velocities, system.masses):
+            f.write(np.ascontiguousarray(a, dtype='<f8').tobytes())
+        f.write(block)
+
+
+def plummer(n, total_mass=1.0, scale=1.0, seed=0):
+    '''
+        Plummer sphere of n equal-mass bodies (G = 1), sampled as in
+        Aarseth, Henon and Wielen (1974), centre of mass at rest at the origin
+    '''
+    rng = np.random.default_rng(seed)
+    # radii, the outermost 0.1% of the mass is cut off
+    x = rng.uniform(0.0, 0.999, n)
+    r = 1.0 / np.sqrt(x ** (-2.0 / 3.0) - 1.0)
+    positions = r[:, None] * _isotropic(rng, n)
+
+    # speeds as a fraction q of the escape speed, g(q) = q^2 (1 - q^2)^3.5
+    q = np.empty(0)
+    while len(q) < n:
+        x4 = rng.uniform(0.0, 1.0, 2 * n)
+        x5 = rng.uniform(0.0, 0.1, 2 * n)
+        q = np.r_[q, x4[x5 < x4 * x4 * (1.0 - x4 * x4) ** 3.5]]
+    speed = q[:n] * np.sqrt(2.0) * (1.0 + r * r) ** (-0.25)
+    velocities = speed[:, None] * _isotropic(rng, n)
+
+    masses = np.full(n, total_mass / n)
+    positions -= positions.mean(axis=0)
+    velocities -= velocities.mean(axis=0)
+    return NBodySystem(positions * scale,
+                       velocities * np.sqrt(total_mass / scale), masses)
+
+
+def uniform_disk(n, radius=1.0, central_mass=1.0, disk_mass=0.01,
+                 inner=0.1, thickness=0.0, seed=0):
+    '''
+        central body 'center' plus n - 1 bodies spread uniformly over the
+        annulus inner * radius < r < radius on circular orbits (G = 1)
+    '''
+    rng = np.random.default_rng(seed)
+    m = n - 1
+    r = radius * np.sqrt(rng.uniform(inner * inner, 1.0, m))
+    phi = rng.uniform(0.0, 2.0 * np.pi, m)
+    z = thickness * radius * rng.normal(size=m)
+    enclosed = central_mass + disk_mass * (r * r - (inner * radius) ** 2) / \
+        (radius * radius * (1.0 - inner * inner))
+    speed = np.sqrt(enclosed / r)
+
+    positions = np.zeros((n, 3))
+    velocities = np.zeros((n, 3))
+    positions[1:] = np.column_stack([r * np.cos(phi), r * np.sin(phi), z])
+    velocities[1:] = np.column_stack([-speed * np.sin(phi),
+                                      speed * np.cos(phi), np.zeros(m)])
+    masses = np.r_[central_mass, np.full(m, disk_mass / max(m, 1))]
+    names = ['center'] + [str(i) for i in range(1, n)]
+    return NBodySystem(positions, velocities, masses, names)
+
+
+def random_cluster(n, seed=0):
+    '''
+        gaussian cluster of n equal-mass bodies with total mass 1
+    '''
+    rng = np.random.default_rng(seed)
+    positions = rng.normal(size=(n, 3))
+    velocities = rng.normal(scale=0.1, size=(n, 3))
+    return NBodySystem(positions, velocities, np.full(n, 1.0 / n))
+
+
+def _isotropic(rng, n):
+    '''
+        n random unit vectors
+    '''
+    cos_theta = rng.uniform(-1.0, 1.0, n)
+    sin_theta = np.sqrt(1.0 - cos_theta * cos_theta)
+    phi = rng.uniform(0.0, 2.0 * np.pi, n)
+    return np.column_stack([sin_theta * np.cos(phi),
+                            sin_theta * np.sin(phi), cos_theta])
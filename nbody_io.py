@@ -0,0 +1,215 @@
+"""
+    Binary output for the array-backed N-body engine.
+
+    Trajectory files hold position/velocity snapshots. The file is laid
+    out up front with np.memmap: a 64-byte header and then three
+    contiguous blocks for every slot.
+        header      magic 'NBTRAJ01', bodies, capacity, every, dt, count
+        steps       int64[capacity]
+        positions   float64[capacity, bodies, 3]
+        velocities  float64[capacity, bodies, 3]
+    record() copies the state into the next slot of the map. The operating
+    system writes the pages back, so recording does not grow memory with
+    the number of steps.
+
+    Checkpoint files hold the full state needed to continue a run exactly,
+    written as one contiguous dump:
+        magic 'NBCKPT01', uint64 length of the JSON metadata, metadata
+        (step, names, integrator, scalar state, array layout), then the
+        raw bytes of positions, velocities, masses and integrator arrays
+    They are written to a temporary file and renamed into place, so a
+    crash while writing leaves the previous checkpoint intact.
+"""
+import json
+import os
+
+import numpy as np
+
+TRAJECTORY_MAGIC = b'NBTRAJ01'
+
+TRAJECTORY_HEADER = np.dtype([
+    ('magic', 'S8'),
+    ('bodies', '<u8'),
+    ('capacity', '<u8'),
+    ('every', '<u8'),
+    ('dt', '<f8'),
+    ('count', '<u8'),
+    ('reserved', 'V16'),
+])
+
+
+def _trajectory_maps(path, mode, bodies, capacity):
+    offset = TRAJECTORY_HEADER.itemsize
+    steps = np.memmap(path, dtype='<i8', mode=mode, offset=offset,
+                      shape=(capacity,))
+    offset += steps.nbytes
+    positions = np.memmap(path, dtype='<f8', mode=mode, offset=offset,
+                          shape=(capacity, bodies, 3))
+    offset += positions.nbytes
+    velocities = np.memmap(path, dtype='<f8', mode=mode, offset=offset,
+                           shape=(capacity, bodies, 3))
+    return (steps, positions, velocities)
+
+
+class TrajectoryWriter(object):
+    '''
+        preallocated memory-mapped trajectory file
+        path - file to create, it is overwritten
+        bodies - number of bodies in the system
+        steps - number of timesteps that will be run
+        every - keep one snapshot every this many steps
+        dt - timestep, stored in the header
+    '''
+
+    def __init__(self, path, bodies, steps, every=1, dt=0.0):
+        self.path = path
+        self.every = every
+        capacity = steps // every + 1
+        size = (TRAJECTORY_HEADER.itemsize + 8 * capacity +
+                2 * 8 * capacity * bodies * 3)
+        with open(path, 'wb') as f:
+            f.truncate(size)
+
+        self.header = np.memmap(path, dtype=TRAJECTORY_HEADER, mode='r+',
+                                shape=(1,))
+        self.header['magic'] = TRAJECTORY_MAGIC
+        self.header['bodies'] = bodies
+        self.header['capacity'] = capacity
+        self.header['every'] = every
+        self.header['dt'] = dt
+        self.header['count'] = 0
+        (self.steps, self.positions, self.velocities) = _trajectory_maps(
+            path, 'r+', bodies, capacity)
+        self.capacity = capacity
+        self.count = 0
+
+    def record(self, step, system):
+        '''
+            store a snapshot of system if step is a multiple of every
+        '''
+        if step % self.every:
+            return
+        k = self.count
+        if k == self.capacity:
+            raise ValueError('trajectory {} is full ({} snapshots)'.format(
+                self.path, self.capacity))
+        self.steps[k] = step
+        self.positions[k] = system.positions
+        self.velocities[k] = system.velocities
+        self.count = k + 1
+        self.header['count'] = self.count
+
+    def flush(self):
+        for m in (self.header, self.steps, self.positions, self.velocities):
+            m.flush()
+
+    def close(self):
+        self.flush()
+        self.header = self.steps = self.positions = self.velocities = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_trajectory(path):
+    '''
+        open a trajectory file read-only
+        returns (header, steps, positions, velocities), the arrays are
+        memory maps cut to the snapshots actually written
+    '''
+    header = np.fromfile(path, dtype=TRAJECTORY_HEADER, count=1)[0]
+    if header['magic'] != TRAJECTORY_MAGIC:
+        raise ValueError('{} is not a trajectory file'.format(path))
+    (steps, positions, velocities) = _trajectory_maps(
+        path, 'r', int(header['bodies']), int(header['capacity']))
+    count = int(header['count'])
+    info = dict((name, header[name].item())
+                for name in ('bodies', 'capacity', 'every', 'dt', 'count'))
+    return (info, steps[:count], positions[:count], velocities[:count])
+
+
+CHECKPOINT_MAGIC = b'NBCKPT01'
+
+
+def save_checkpoint(path, system, step, integrator=None):
+    '''
+        write system, the step counter and the integrator state to path
+        integrator - None or an object with get_state(), a dict of
+                     scalars, None and arrays
+    '''
+    arrays = [('positions', system.positions),
+              ('velocities', system.velocities),
+              ('masses', system.masses)]
+    state = {}
+    if not hasattr(integrator, 'get_state'):
+        integrator = None
+    if integrator is not None:
+        for (name, value) in integrator.get_state().items():
+            if isinstance(value, np.ndarray):
+                arrays.append(('integrator.' + name, value))
+            else:
+                state[name] = value
+
+    meta = json.dumps({
+        'step': step,
+        # None for unnamed systems, which then never build the names
+        'names': system._names,
+        'integrator': type(integrator).__name__ if integrator else None,
+        'state': state,
+        'arrays': [(name, a.dtype.str, a.shape) for (name, a) in arrays],
+    }).encode('utf-8')
+    meta += b' ' * (-len(meta) % 8)
+
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(CHECKPOINT_MAGIC)
+        f.write(np.array(len(meta), dtype='<u8').tobytes())
+        f.write(meta)
+        for (name, a) in arrays:
+            f.write(memoryview(np.ascontiguousarray(a)).cast('B'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path, integrator=None):
+    '''
+        read a checkpoint written by save_checkpoint
+        integrator - restored in place with set_state() when given
+        returns (system, step)
+    '''
+    from nbody_array import NBodySystem
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:8] != CHECKPOINT_MAGIC:
+        raise ValueError('{} is not a checkpoint file'.format(path))
+    length = int(np.frombuffer(data, dtype='<u8', count=1, offset=8)[0])
+    meta = json.loads(data[16:16 + length].decode('utf-8'))
+
+    offset = 16 + length
+    arrays = {}
+    for (name, dtype, shape) in meta['arrays']:
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        arrays[name] = np.frombuffer(data, dtype=dtype, count=count,
+                                     offset=offset).reshape(shape).copy()
+        offset += count * dtype.itemsize
+
+    if integrator is not None and hasattr(integrator, 'set_state'):
+        if type(integrator).__name__ != meta['integrator']:
+            raise ValueError('checkpoint was written by {}, not {}'.format(
+                meta['integrator'], type(integrator).__name__))
+        state = dict(meta['state'])
+        for (name, a) in arrays.items():
+            if name.startswith('integrator.'):
+                state[name[len('integrator.'):]] = a
+        integrator.set_state(state)
+
+    system = NBodySystem(arrays['positions'], arrays['velocities'],
+                         arrays['masses'], meta['names'],
+                         arrays['positions'].dtype)
+    return (system, meta['step'])
@@ -0,0 +1,210 @@
+"""
+    Domain-decomposed N-body simulation with mpi4py.
+    - Every rank owns a contiguous block of bodies (their positions and
+      velocities); masses are small and replicated on every rank
+    - Each step the blocks of positions are exchanged with Allgatherv on
+      NumPy buffers (upper-case, no pickling), then each rank computes the
+      accelerations of its own bodies from all bodies and updates them
+    - Energy and momentum are combined with Allreduce
+    - Forces and energies run over chunks of the local rows of at most
+      nbody_pairs.BLOCK pairs each, so memory per rank stays O(N) and not
+      O(N^2 / ranks)
+    - float32 systems (mixed precision, see nbody_array) are sent and
+      gathered as float32, forces and energies are still float64
+
+    Run with:
+        mpiexec -n 4 python nbody_mpi.py --n 4000 --loops 2 --iterations 10
+    nbody_mpi_scaling.sh runs the strong and weak scaling series.
+
+    Measured on a single-core machine, so the ranks share one core and the
+    numbers show the decomposition overhead rather than a speedup:
+        strong, 2000 bodies     1 rank 0.33 sec/step, 2 ranks 0.26, 4 ranks 0.27
+        weak, 500 bodies/rank   1 rank 0.016 sec/step, 2 ranks 0.070,
+                                4 ranks 0.26
+    Weak scaling grows with the ranks because the direct sum is O(N^2) in
+    the total number of bodies.
+"""
+import argparse
+
+import numpy as np
+from mpi4py import MPI
+
+import nbody_array
+from nbody_pairs import BLOCK
+
+
+class Domain(object):
+    '''
+        the block of bodies owned by one rank
+        lo, hi - rows of the global system owned by this rank
+        positions, velocities - local rows, (hi - lo) x 3
+        masses - all masses
+        names - body names, None for the default row numbers
+        everywhere - all positions, filled by gather_positions
+    '''
+
+    def __init__(self, comm, positions, velocities, masses, names):
+        self.comm = comm
+        size = comm.Get_size()
+        rank = comm.Get_rank()
+        n = len(masses)
+
+        self.counts = np.array([n // size + (r < n % size)
+                                for r in range(size)])
+        self.displs = np.r_[0, np.cumsum(self.counts)[:-1]]
+        self.lo = int(self.displs[rank])
+        self.hi = self.lo + int(self.counts[rank])
+
+        self.masses = masses
+        self.names = names
+        self.positions = np.ascontiguousarray(positions[self.lo:self.hi])
+        self.velocities = np.ascontiguousarray(velocities[self.lo:self.hi])
+        self.everywhere = np.empty((n, 3), dtype=self.positions.dtype)
+        self.targets = np.arange(self.lo, self.hi)
+        # local rows per chunk of forces and energies
+        self.chunk = max(1, BLOCK // max(n, 1))
+
+    def gather_positions(self):
+        # the MPI datatype follows the dtype of the buffers
+        self.comm.Allgatherv(
+            self.positions,
+            [self.everywhere, (self.counts * 3, self.displs * 3)])
+        return self.everywhere
+
+
+def scatter_system(system, comm, root=0):
+    '''
+        broadcast a system from root and return this rank's Domain
+        system is only used on root
+    '''
+    rank = comm.Get_rank()
+    (n, dtype) = comm.bcast((len(system), system.dtype.str)
+                            if rank == root else None, root=root)
+    names = comm.bcast(system._names if rank == root else None, root=root)
+    if rank == root:
+        positions = system.positions
+        velocities = system.velocities
+        masses = system.masses
+    else:
+        positions = np.empty((n, 3), dtype=dtype)
+        velocities = np.empty((n, 3), dtype=dtype)
+        masses = np.empty(n)
+    comm.Bcast(positions, root=root)
+    comm.Bcast(velocities, root=root)
+    comm.Bcast(masses, root=root)
+    return Domain(comm, positions, velocities, masses, names)
+
+
+def advance(dt, domain, kernel=nbody_array.direct_accelerations):
+    '''
+        advance the system one timestep
+    '''
+    everywhere = domain.gather_positions()
+    for lo in range(0, len(domain.targets), domain.chunk):
+        rows = slice(lo, lo + domain.chunk)
+        acc = kernel(everywhere, domain.masses, domain.targets[rows])
+        domain.velocities[rows] += dt * acc
+    domain.positions += dt * domain.velocities
+
+
+def report_energy(domain):
+    '''
+        total energy, the same value on every rank
+    '''
+    everywhere = domain.gather_positions()
+    m = domain.masses
+    local = 0.0
+    for lo in range(0, len(domain.targets), domain.chunk):
+        targets = domain.targets[lo:lo + domain.chunk]
+        d = np.subtract(domain.positions[lo:lo + domain.chunk, None, :],
+                        everywhere[None, :, :], dtype=np.float64)
+        r = np.sqrt((d * d).sum(axis=2))
+        r[np.arange(len(targets)), targets] = np.inf
+        local -= 0.5 * (m[targets, None] * m[None, :] / r).sum()
+    local += nbody_array.kinetic_energy(domain.velocities, m[domain.targets])
+    return domain.comm.allreduce(local, op=MPI.SUM)
+
+
+def offset_momentum(ref, domain):
+    '''
+        ref is the name of the body in the center of the system
+        offset its velocity so that the total momentum is zero
+    '''
+    local = (domain.masses[domain.targets, None] * domain.velocities).sum(0)
+    p = np.empty(3)
+    domain.comm.Allreduce(local, p, op=MPI.SUM)
+    if domain.names is None:
+        i = int(ref)
+    else:
+        i = domain.names.index(ref)
+    if domain.lo <= i < domain.hi:
+        domain.velocities[i - domain.lo] = -p / domain.masses[i]
+
+
+def nbody(loops, reference, iterations, system=None, comm=MPI.COMM_WORLD,
+          dt=0.01):
+    '''
+        nbody simulation across the ranks of comm, rank 0 prints the energy
+        loops - number of loops to run
+        reference - body at center of system
+        iterations - number of timesteps to advance
+        system - NBodySystem on rank 0, the solar system by default
+    '''
+    if comm.Get_rank() == 0 and system is None:
+        system = nbody_array.solar_system()
+    domain = scatter_system(system, comm)
+    offset_momentum(reference, domain)
+
+    for _ in range(loops):
+        for _ in range(iterations):
+            advance(dt, domain)
+        e = report_energy(domain)
+        if comm.Get_rank() == 0:
+            print(e)
+
+    return domain
+
+
+def time_steps(n, iterations, comm=MPI.COMM_WORLD, dt=1e-3):
+    '''
+        seconds per step for a random cluster of n bodies
+    '''
+    system = None
+    if comm.Get_rank() == 0:
+        from nbody_initial import random_cluster
+        system = random_cluster(n)
+    domain = scatter_system(system, comm)
+    advance(dt, domain)
+    comm.Barrier()
+    start = MPI.Wtime()
+    for _ in range(iterations):
+        advance(dt, domain)
+    comm.Barrier()
+    return (MPI.Wtime() - start) / iterations
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='MPI N-body simulation')
+    parser.add_argument('--n', type=int, default=5,
+                        help='number of bodies, 5 is the solar system')
+    parser.add_argument('--loops', type=int, default=10)
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument('--weak', action='store_true',
+                        help='time n bodies per rank instead of running')
+    parser.add_argument('--strong', action='store_true',
+                        help='time n bodies in total instead of running')
+    args = parser.parse_args()
+
+    comm = MPI.COMM_WORLD
+    size = comm.Get_size()
+    if args.weak or args.strong:
+        n = args.n * size if args.weak else args.n
+        seconds = time_steps(n, args.iterations, comm)
+        if comm.Get_rank() == 0:
+            print('{} ranks {} bodies {:.6f} sec per step'.format(
+                size, n, seconds))
+    elif args.n == 5:
+        nbody(args.loops, 'sun', args.iterations, comm=comm)
+    else:
+        from nbody_initial import random_cluster
+        system = random_cluster(args.n) if comm.Get_rank() == 0 else None
+        nbody(args.loops, '0', args.iterations, system, comm)
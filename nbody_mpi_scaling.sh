@@ -0,0 +1,4 @@
+# Strong scaling: 2000 bodies in total
+for n in 1 2 4 8; do mpiexec -n $n python nbody_mpi.py --strong --n 2000 --iterations 5; done
+# Weak scaling: 500 bodies per rank
+for n in 1 2 4 8; do mpiexec -n $n python nbody_mpi.py --weak --n 500 --iterations 5; done
@@ -0,0 +1,227 @@
+"""
+    N-body simulation, numba nopython backend.
+    nbody_numba.py gives numba dicts and lists, which it cannot compile in
+    nopython mode, so it ran in object mode. This backend works on the flat
+    arrays of an nbody_array.NBodySystem instead.
+    - @njit(fastmath=True, cache=True) with explicit signatures, so the
+      kernels are compiled when the module is imported and the machine code
+      is cached on disk (__pycache__) for the next job start
+    - small systems use the symmetric pair loop, systems with at least
+      PARALLEL_THRESHOLD bodies accumulate forces in a prange loop, one body
+      per iteration, so threads never write to the same row
+    - advance(..., schedule=nbody_pairs.schedule(n)) runs over the int32
+      pair arrays of the shared schedule instead, tile by tile
+
+    python nbody_njit.py --warmup fills the on-disk cache without running.
+"""
+import sys
+
+from numba import njit, prange
+
+import nbody_array
+
+PARALLEL_THRESHOLD = 256
+
+ADVANCE_SIG = ('void(float64, float64[:, ::1], float64[:, ::1], float64[::1], '
+               'int64)')
+
+KICK_SIG = ('void(float64, float64[:, ::1], float64[:, ::1], float64[::1], '
+            'int32[::1], int32[::1])')
+
+SCHEDULE_SIG = ('void(float64, float64[:, ::1], float64[:, ::1], '
+                'float64[::1], int32[::1], int32[::1], int64)')
+
+
+@njit(ADVANCE_SIG, fastmath=True, cache=True)
+def advance_pairs(dt, r, v, m, steps):
+    '''
+        advance the system steps timesteps, symmetric pair loop
+    '''
+    n = m.shape[0]
+    for _ in range(steps):
+        for i in range(n):
+            for j in range(i + 1, n):
+                dx = r[i, 0] - r[j, 0]
+                dy = r[i, 1] - r[j, 1]
+                dz = r[i, 2] - r[j, 2]
+
+                mag = dt * ((dx * dx + dy * dy + dz * dz) ** (-1.5))
+                mag_2 = m[j] * mag
+                mag_1 = m[i] * mag
+
+                v[i, 0] -= dx * mag_2
+                v[i, 1] -= dy * mag_2
+                v[i, 2] -= dz * mag_2
+                v[j, 0] += dx * mag_1
+                v[j, 1] += dy * mag_1
+                v[j, 2] += dz * mag_1
+
+        for i in range(n):
+            r[i, 0] += dt * v[i, 0]
+            r[i, 1] += dt * v[i, 1]
+            r[i, 2] += dt * v[i, 2]
+
+
+@njit(ADVANCE_SIG, fastmath=True, cache=True, parallel=True)
+def advance_parallel(dt, r, v, m, steps):
+    '''
+        advance the system steps timesteps, each thread owns a block of
+        bodies and sums the force on them from every other body
+    '''
+    n = m.shape[0]
+    for _ in range(steps):
+        for i in prange(n):
+            ax = 0.0
+            ay = 0.0
+            az = 0.0
+            for j in range(n):
+                if j != i:
+                    dx = r[i, 0] - r[j, 0]
+                    dy = r[i, 1] - r[j, 1]
+                    dz = r[i, 2] - r[j, 2]
+                    mag = m[j] * ((dx * dx + dy * dy + dz * dz) ** (-1.5))
+                    ax -= dx * mag
+                    ay -= dy * mag
+                    az -= dz * mag
+            v[i, 0] += dt * ax
+            v[i, 1] += dt * ay
+            v[i, 2] += dt * az
+
+        for i in prange(n):
+            r[i, 0] += dt * v[i, 0]
+            r[i, 1] += dt * v[i, 1]
+            r[i, 2] += dt * v[i, 2]
+
+
+@njit(KICK_SIG, fastmath=True, cache=True)
+def kick_pairs(dt, r, v, m, pi, pj):
+    '''
+        velocity update from the pairs (pi[k], pj[k])
+    '''
+    for k in range(pi.shape[0]):
+        i = pi[k]
+        j = pj[k]
+        dx = r[i, 0] - r[j, 0]
+        dy = r[i, 1] - r[j, 1]
+        dz = r[i, 2] - r[j, 2]
+
+        mag = dt * ((dx * dx + dy * dy + dz * dz) ** (-1.5))
+        mag_2 = m[j] * mag
+        mag_1 = m[i] * mag
+
+        v[i, 0] -= dx * mag_2
+        v[i, 1] -= dy * mag_2
+        v[i, 2] -= dz * mag_2
+        v[j, 0] += dx * mag_1
+        v[j, 1] += dy * mag_1
+        v[j, 2] += dz * mag_1
+
+
+@njit('void(float64, float64[:, ::1], float64[:, ::1])', fastmath=True,
+      cache=True)
+def drift(dt, r, v):
+    for i in range(r.shape[0]):
+        r[i, 0] += dt * v[i, 0]
+        r[i, 1] += dt * v[i, 1]
+        r[i, 2] += dt * v[i, 2]
+
+
+@njit(SCHEDULE_SIG, fastmath=True, cache=True)
+def advance_schedule(dt, r, v, m, pi, pj, steps):
+    '''
+        advance the system steps timesteps over a stored pair schedule
+    '''
+    for _ in range(steps):
+        kick_pairs(dt, r, v, m, pi, pj)
+        drift(dt, r, v)
+
+
+@njit('float64(float64[:, ::1], float64[::1], int32[::1], int32[::1])',
+      fastmath=True, cache=True)
+def potential_pairs(r, m, pi, pj):
+    '''
+        potential energy of the pairs (pi[k], pj[k])
+    '''
+    e = 0.0
+    for k in range(pi.shape[0]):
+        i = pi[k]
+        j = pj[k]
+        dx = r[i, 0] - r[j, 0]
+        dy = r[i, 1] - r[j, 1]
+        dz = r[i, 2] - r[j, 2]
+        e -= (m[i] * m[j]) / ((dx * dx + dy * dy + dz * dz) ** 0.5)
+    return e
+
+
+@njit('float64(float64[:, ::1], float64[:, ::1], float64[::1])',
+      fastmath=True, cache=True)
+def energy(r, v, m):
+    '''
+        total energy of the system
+    '''
+    n = m.shape[0]
+    e = 0.0
+    for i in range(n):
+        for j in range(i + 1, n):
+            dx = r[i, 0] - r[j, 0]
+            dy = r[i, 1] - r[j, 1]
+            dz = r[i, 2] - r[j, 2]
+            e -= (m[i] * m[j]) / ((dx * dx + dy * dy + dz * dz) ** 0.5)
+
+    for i in range(n):
+        e += m[i] * (v[i, 0] * v[i, 0] + v[i, 1] * v[i, 1] +
+                     v[i, 2] * v[i, 2]) / 2.
+    return e
+
+
+def advance(dt, system, steps=1, schedule=None):
+    '''
+        advance the system steps timesteps
+        schedule - optional nbody_pairs.PairSchedule to run over
+    '''
+    (r, v, m) = (system.positions, system.velocities, system.masses)
+    if schedule is not None and schedule.stored:
+        advance_schedule(dt, r, v, m, schedule.i, schedule.j, steps)
+    elif schedule is not None:
+        for _ in range(steps):
+            for (pi, pj) in schedule.blocks():
+                kick_pairs(dt, r, v, m, pi, pj)
+            drift(dt, r, v)
+    elif len(system) >= PARALLEL_THRESHOLD:
+        advance_parallel(dt, r, v, m, steps)
+    else:
+        advance_pairs(dt, r, v, m, steps)
+
+
+def report_energy(system, e=0.0, schedule=None):
+    '''
+        compute the energy and return it so that it can be printed
+    '''
+    if schedule is None:
+        return e + energy(system.positions, system.velocities, system.masses)
+    for (pi, pj) in schedule.blocks():
+        e += potential_pairs(system.positions, system.masses, pi, pj)
+    return e + nbody_array.kinetic_energy(system.velocities, system.masses)
+
+
+def nbody(loops, reference, iterations, system=None):
+    '''
+        nbody simulation
+        loops - number of loops to run
+        reference - body at center of system
+        iterations - number of timesteps to advance
+        system - NBodySystem to evolve, the solar system by default
+    '''
+    if system is None:
+        system = nbody_array.solar_system()
+    nbody_array.offset_momentum(reference, system)
+
+    for _ in range(loops):
+        advance(0.01, system, iterations)
+        print(report_energy(system))
+
+    return system
+
+if __name__ == '__main__':
+    if '--warmup' not in sys.argv[1:]:
+        nbody(100, 'sun', 20000)
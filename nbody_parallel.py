@@ -0,0 +1,125 @@
+"""
+    Multiprocess force evaluation for large-N runs.
+    - Positions, velocities and masses of the system are moved into
+      multiprocessing.shared_memory blocks, so worker processes see every
+      update without the body state being pickled
+    - Each force evaluation sends only (start, stop) row ranges to the pool,
+      every worker writes the accelerations of its rows into a shared
+      output buffer; rows are disjoint so no reduction step is needed
+    - The per-worker kernel is any nbody_array kernel that accepts targets
+
+    Use it through nbody_array.nbody(..., workers=4), or directly:
+        with SharedMemoryKernel(system, workers=4) as kernel:
+            nbody_array.advance(0.01, system, kernel)
+"""
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import nbody_array
+
+# worker-process state, set by _attach
+_shared = {}
+
+
+def _attach(names, n, kernel, dtype=np.float64):
+    blocks = [shared_memory.SharedMemory(name=name) for name in names]
+    _shared['blocks'] = blocks
+    _shared['positions'] = np.ndarray((n, 3), dtype=dtype,
+                                      buffer=blocks[0].buf)
+    _shared['masses'] = np.ndarray((n,), buffer=blocks[2].buf)
+    _shared['acc'] = np.ndarray((n, 3), buffer=blocks[3].buf)
+    _shared['kernel'] = kernel
+
+
+def _rows(task):
+    '''
+        accelerations of one block of target rows
+    '''
+    (start, stop, targets) = task
+    if targets is None:
+        targets = np.arange(start, stop)
+    _shared['acc'][start:stop] = _shared['kernel'](
+        _shared['positions'], _shared['masses'], targets)
+
+
+class SharedMemoryKernel(object):
+    '''
+        force kernel that splits the target bodies across a process pool
+        system - NBodySystem, its arrays are replaced by shared-memory views
+        workers - number of processes, all cores by default
+        kernel - per-worker kernel (positions, masses, targets)
+        blocks - number of row blocks per worker and evaluation
+    '''
+
+    def __init__(self, system, workers=None,
+                 kernel=nbody_array.direct_accelerations, blocks=4):
+        self.workers = workers or multiprocessing.cpu_count()
+        self.blocks = blocks
+        n = len(system)
+        self._memory = []
+        arrays = []
+        for a in (system.positions, system.velocities, system.masses,
+                  np.zeros((n, 3))):
+            block = shared_memory.SharedMemory(create=True,
+                                               size=max(a.nbytes, 1))
+            shared = np.ndarray(a.shape, dtype=a.dtype, buffer=block.buf)
+            shared[...] = a
+            self._memory.append(block)
+            arrays.append(shared)
+        (system.positions, system.velocities, system.masses,
+         self._acc) = arrays
+        self.system = system
+        self.positions = system.positions
+
+        self._pool = multiprocessing.Pool(
+            self.workers, initializer=_attach,
+            initargs=([block.name for block in self._memory], n, kernel,
+                      system.dtype))
+
+    def __call__(self, positions, masses, targets=None):
+        if positions is not self.positions:
+            self.positions[...] = positions
+        count = len(masses) if targets is None else len(targets)
+        edges = np.linspace(0, count, self.workers * self.blocks + 1)
+        edges = np.unique(edges.astype(np.int64))
+        ranges = zip(edges[:-1], edges[1:])
+        if targets is None:
+            tasks = [(lo, hi, None) for (lo, hi) in ranges]
+        else:
+            targets = np.asarray(targets)
+            tasks = [(lo, hi, targets[lo:hi]) for (lo, hi) in ranges]
+        self._pool.map(_rows, tasks)
+        return self._acc[:count].copy()
+
+    def close(self):
+        '''
+            stop the workers and free the shared memory, the system arrays
+            are copied back to private memory first
+        '''
+        if self._pool is None:
+            return
+        self._pool.terminate()
+        self._pool.join()
+        self._pool = None
+
+        system = self.system
+        system.positions = system.positions.copy()
+        system.velocities = system.velocities.copy()
+        system.masses = system.masses.copy()
+        self.system = self.positions = self._acc = None
+        for block in self._memory:
+            try:
+                block.close()
+            except BufferError:
+                # a view is still alive somewhere, the mapping goes away
+                # with it, the name can still be released
+                pass
+            block.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,115 @@
+"""
+    Mixed precision against double precision.
+    NBodySystem(..., dtype=np.float32) and Ensemble(..., dtype=np.float32)
+    store the state in float32: positions and velocities, and for the
+    ensemble the S x N x N x 3 separation buffer. Every separation is
+    widened to float64 before it is squared, forces, potential and kinetic
+    energy are summed in float64 and report_energy returns a float64. Only
+    the stored state is rounded, once per kick and once per drift.
+
+    python nbody_precision.py runs both engines in both modes and prints
+    the largest relative energy drift |E - E0| / |E0| over the run and the
+    distance of the final positions from the float64 run. On one core:
+
+      solar system, nbody_array, 20000 steps, dt = 0.01
+        float64   state 240 bytes      drift 3.9e-04   position error 0
+        float32   state 120 bytes      drift 3.9e-04   position error 2.7e-03
+      20 Plummer spheres, N = 200, nbody_ensemble, 100 steps, dt = 1e-3
+        float64   buffer 19.2 MB   31.7 ms per step    drift 3.1e-05
+        float32   buffer  9.6 MB   42.2 ms per step    drift 3.1e-05
+      Plummer sphere, N = 1000, nbody_array, 200 steps, dt = 1e-3
+        float64   83.4 ms per step     drift 9.6e-06   position error 0
+        float32   89.0 ms per step     drift 9.6e-06   position error 1.5e-04
+
+    Float32 storage leaves the energy drift of the integrator, which
+    dominates, unchanged to two digits; the price is a trajectory that
+    departs from the float64 one at the float32 rounding level and grows
+    from there, so use it for statistics over large ensembles, not for
+    long exact orbits. The gain is memory, the state and the ensemble
+    buffer are halved. It is not speed in NumPy: widening every float32
+    operand costs more than the narrower loads save, steps are 7-30%
+    slower on this machine.
+"""
+import time
+
+import numpy as np
+
+import nbody_array
+import nbody_ensemble
+from nbody_initial import plummer
+
+
+def drift(system, steps, dt=0.01, every=100, kernel=None):
+    '''
+        evolve a copy of system with nbody_array.advance
+        returns (largest relative energy drift, seconds per step, final
+        positions as float64)
+    '''
+    system = system.copy()
+    kernel = kernel or nbody_array.direct_accelerations
+    e0 = nbody_array.report_energy(system)
+    worst = 0.0
+    seconds = 0.0
+    for step in range(1, steps + 1):
+        start = time.perf_counter()
+        nbody_array.advance(dt, system, kernel)
+        seconds += time.perf_counter() - start
+        if step % every == 0:
+            e = nbody_array.report_energy(system)
+            worst = max(worst, abs((e - e0) / e0))
+    return (worst, seconds / steps, system.positions.astype(np.float64))
+
+
+def ensemble_drift(ensemble, steps, dt=0.01, every=100):
+    '''
+        largest relative energy drift over the systems of an ensemble and
+        seconds per step
+    '''
+    e0 = nbody_ensemble.report_energy(ensemble)
+    worst = 0.0
+    seconds = 0.0
+    for step in range(1, steps + 1):
+        start = time.perf_counter()
+        nbody_ensemble.advance(dt, ensemble)
+        seconds += time.perf_counter() - start
+        if step % every == 0:
+            e = nbody_ensemble.report_energy(ensemble)
+            worst = max(worst, np.abs((e - e0) / e0).max())
+    return (worst, seconds / steps)
+
+
+def compare(system, steps, dt=0.01, every=100):
+    '''
+        print the float64 and float32 runs of system side by side
+    '''
+    reference = None
+    for dtype in (np.float64, np.float32):
+        mixed = system.astype(dtype)
+        (worst, seconds, positions) = drift(mixed, steps, dt, every)
+        if reference is None:
+            reference = positions
+        error = np.abs(positions - reference).max()
+        print('    {:<9} state {:>6} bytes   step {:8.3f} ms   drift {:.1e}'
+              '   position error {:.1e}'.format(
+                  np.dtype(dtype).name,
+                  mixed.positions.nbytes + mixed.velocities.nbytes,
+                  1e3 * seconds, worst, error))
+
+if __name__ == '__main__':
+    solar = nbody_array.solar_system()
+    nbody_array.offset_momentum('sun', solar)
+    print('solar system, nbody_array, 20000 steps, dt = 0.01')
+    compare(solar, 20000)
+
+    print('20 Plummer spheres, N = 200, nbody_ensemble, 100 steps, '
+          'dt = 1e-3')
+    for dtype in (np.float64, np.float32):
+        ensemble = nbody_ensemble.Ensemble.from_system(
+            plummer(200), 20, 1e-3, dtype=dtype)
+        (worst, seconds) = ensemble_drift(ensemble, 100, dt=1e-3, every=20)
+        print('    {:<9} buffer {:>9} bytes   step {:8.3f} ms   '
+              'drift {:.1e}'.format(np.dtype(dtype).name,
+                                    ensemble._d.nbytes, 1e3 * seconds, worst))
+
+    print('Plummer sphere, N = 1000, nbody_array, 200 steps, dt = 1e-3')
+    compare(plummer(1000), 200, dt=1e-3, every=20)
@@ -0,0 +1,91 @@
+"""
+    Per-phase timing for the array-backed N-body engine.
+    nbody_array.nbody(..., profile=True) wraps its hooks in timers:
+        step     one integrator call, force evaluation included
+        force    kernel calls
+        energy   energy reports
+        io       printing, trajectory snapshots and checkpoints
+    The kick/drift time is step minus force. Pair interactions are
+    counted as in the direct sum, N (N - 1) / 2 per full evaluation, so
+    pairs per second can be compared across kernels.
+    With profile off, nothing is wrapped and the loop calls the plain
+    functions, so there is no overhead.
+"""
+import sys
+import time
+
+
+class Profiler(object):
+    '''
+        accumulated seconds and calls per phase, plus pair interactions
+    '''
+
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+        self.pairs = 0
+
+    def add(self, name, seconds):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def wrap(self, name, function):
+        '''
+            function timed under name
+        '''
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(name, time.perf_counter() - start)
+        return timed
+
+    def wrap_kernel(self, kernel, bodies):
+        '''
+            force kernel timed under 'force', counting pair interactions
+        '''
+        timed = self.wrap('force', kernel)
+        full = bodies * (bodies - 1) // 2
+
+        def counted(positions, masses, targets=None, **kwargs):
+            if targets is None:
+                self.pairs += full
+                return timed(positions, masses, **kwargs)
+            self.pairs += len(targets) * (bodies - 1)
+            return timed(positions, masses, targets, **kwargs)
+        return counted
+
+    def summary(self):
+        '''
+            dict of phase -> (calls, seconds), with the derived kick/drift
+            phase and pairs per second
+        '''
+        phases = dict((name, (self.calls[name], self.seconds[name]))
+                      for name in self.seconds)
+        if 'step' in phases:
+            force = self.seconds.get('force', 0.0)
+            phases['kick/drift'] = (self.calls['step'],
+                                    self.seconds['step'] - force)
+        force = self.seconds.get('force', 0.0)
+        return {'phases': phases, 'pairs': self.pairs,
+                'pairs_per_second': self.pairs / force if force else 0.0}
+
+    def report(self):
+        '''
+            the summary as a printable table
+        '''
+        summary = self.summary()
+        lines = ['{:>12} {:>10} {:>12} {:>14}'.format(
+            'phase', 'calls', 'seconds', 'usec per call')]
+        for name in ('step', 'force', 'kick/drift', 'energy', 'io'):
+            if name in summary['phases']:
+                (calls, seconds) = summary['phases'][name]
+                lines.append('{:>12} {:>10} {:>12.4f} {:>14.2f}'.format(
+                    name, calls, seconds, 1e6 * seconds / max(calls, 1)))
+        lines.append('{:.4g} pair interactions, {:.4g} per second'.format(
+            summary['pairs'], summary['pairs_per_second']))
+        return '\n'.join(lines)
+
+    def print_report(self, file=sys.stderr):
+        print(self.report(), file=file)